@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Footnote/citation scaling benchmark.
+
+Generates documents with a growing number of footnotes and citations and
+times them with rst2sile as it was before footnotes were batched (one
+insertion per footnote and per citation, and the old footnotes package)
+and as it is now. The old version is taken from git: by default the
+parent of the commit that added footnote batching, or the revision given
+with --before. SILE times are only measured if sile is installed.
+
+Usage: python benchmarks/footnotes.py [--before REV] [N ...]
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in a separate process, so each version imports its own sile package
+GENERATE = '''
+import json, sys, time
+from docutils.core import publish_string
+source = sys.stdin.read()
+start = time.time()
+sile_code = publish_string(
+    source, writer_name='sile',
+    settings_overrides={'report_level': 5}).decode('utf-8')
+translate = time.time() - start
+with open(sys.argv[1], 'w') as sil_file:
+    sil_file.write(sile_code)
+print(json.dumps({'translate': translate,
+                  'insertions': sile_code.count('\\\\footnote')}))
+'''
+
+
+def make_document(count):
+    lines = ['Footnotes', '=========', '']
+    for i in range(1, count + 1):
+        lines.append('Paragraph %d cites [CIT%d]_ and has a note [#]_.' %
+                     (i, i))
+        lines.append('')
+        if i % 10 == 0:
+            for j in range(i - 9, i + 1):
+                lines.append('.. [#] The text of footnote %d.' % j)
+            lines.append('')
+    lines.append('Bibliography')
+    lines.append('------------')
+    lines.append('')
+    for i in range(1, count + 1):
+        lines.append('.. [CIT%d] Author %d, *Some Book*, 2017.' % (i, i))
+    return '\n'.join(lines) + '\n'
+
+
+def before_batching():
+    """The last revision before footnote batching, found in git's history."""
+    added = subprocess.check_output(
+        ['git', 'log', '--format=%H', '--reverse', '-S', 'def footnote_batch',
+         '--', 'sile/__init__.py'],
+        cwd=ROOT, universal_newlines=True).split()
+    if not added:
+        sys.exit('Footnote batching not found in git history, use --before')
+    return added[0] + '^'
+
+
+def checkout(revision, path):
+    """Put the sile package as it was in revision in path."""
+    archive = subprocess.check_output(
+        ['git', 'archive', revision, 'sile'], cwd=ROOT)
+    subprocess.run(['tar', '-x', '-C', path], input=archive, check=True)
+
+
+def run(source, tree):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = tree
+    env['SILE_PATH'] = os.path.join(tree, 'sile')
+    with tempfile.NamedTemporaryFile(suffix='.sil') as sil_file:
+        result = json.loads(subprocess.run(
+            [sys.executable, '-c', GENERATE, sil_file.name],
+            input=source, env=env, cwd=tree, check=True,
+            universal_newlines=True,
+            stdout=subprocess.PIPE).stdout)
+        result['render'] = None
+        if shutil.which('sile'):
+            start = time.time()
+            subprocess.check_call(
+                ['sile', sil_file.name, '-o', sil_file.name + '.pdf'],
+                env=env, stdout=subprocess.DEVNULL)
+            result['render'] = time.time() - start
+            os.unlink(sil_file.name + '.pdf')
+    return result
+
+
+def main(sizes, before):
+    print('%8s %7s %11s %10s %10s' % ('notes', 'version', 'insertions',
+                                      'python s', 'sile s'))
+    with tempfile.TemporaryDirectory() as old_tree:
+        checkout(before, old_tree)
+        for count in sizes:
+            source = make_document(count)
+            for version, tree in (('before', old_tree), ('after', ROOT)):
+                result = run(source, tree)
+                print('%8d %7s %11d %10.2f %10s' %
+                      (count, version, result['insertions'],
+                       result['translate'], '-' if result['render'] is None
+                       else '%.2f' % result['render']))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    before = None
+    if args[:1] == ['--before']:
+        before, args = args[1], args[2:]
+    main([int(n) for n in args] or [100, 1000, 5000],
+         before or before_batching())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""TeX-like vs XML SILE input benchmark.
+
+Generates documents with a growing number of sections and converts them to
+both SILE input formats, timing the Python side and, if sile is installed,
+how long SILE takes to parse and typeset each of them.
+
+Usage: python benchmarks/formats.py [N ...]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docutils.core import publish_string  # noqa: E402
+import sile  # noqa: E402
+
+
+def make_document(count):
+    lines = ['Formats', '=======', '']
+    for i in range(1, count + 1):
+        lines.extend([
+            'Section %d' % i,
+            '-' * len('Section %d' % i),
+            '',
+            'Some *emphasis*, some **strong** text and ``literal {code}`` '
+            'with 100% of the characters {SILE} and XML <care> & about.',
+            '',
+            '* A bullet',
+            '* Another one, with a note [#]_',
+            '',
+            '.. [#] The text of footnote %d.' % i,
+            '',
+            '::',
+            '',
+            '    def f(x):',
+            '        return {"x": x}',
+            '',
+            'See `Section %d`_.' % max(i - 1, 1),
+            '',
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def run(source, sile_format):
+    start = time.time()
+    sile_code = publish_string(
+        source, writer_name='sile',
+        settings_overrides={'report_level': 5,
+                            'sile_format': sile_format}).decode('utf-8')
+    translate = time.time() - start
+    render = None
+    if shutil.which('sile'):
+        suffix = sile.SYNTAXES[sile_format].suffix or '.sil'
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as sil_file:
+            sil_file.write(sile_code)
+            sil_file.flush()
+            env = os.environ.copy()
+            env['SILE_PATH'] = os.path.dirname(sile.__file__)
+            start = time.time()
+            subprocess.check_call(
+                ['sile', sil_file.name, '-o', sil_file.name + '.pdf'],
+                env=env, stdout=subprocess.DEVNULL)
+            render = time.time() - start
+            os.unlink(sil_file.name + '.pdf')
+    return translate, len(sile_code.encode('utf-8')), render
+
+
+def main(sizes):
+    print('%8s %6s %10s %10s %10s' % ('sections', 'format', 'bytes',
+                                      'python s', 'sile s'))
+    for count in sizes:
+        source = make_document(count)
+        for sile_format in ('tex', 'xml'):
+            translate, size, render = run(source, sile_format)
+            print('%8d %6s %10d %10.2f %10s' %
+                  (count, sile_format, size, translate,
+                   '-' if render is None else '%.2f' % render))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100, 1000, 5000])
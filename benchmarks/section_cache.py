@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Section cache benchmark.
+
+Generates documents with a growing number of top-level sections and times
+translating them without the section cache, with an empty cache and with
+every section already cached. The document is parsed once, only the
+translation is timed.
+
+Usage: python benchmarks/section_cache.py [N ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from docutils import frontend  # noqa: E402
+from docutils.core import publish_doctree  # noqa: E402
+import sile  # noqa: E402
+
+
+def make_document(count):
+    lines = ['Section Cache', '=============', '', '.. contents::', '']
+    for i in range(1, count + 1):
+        lines.extend([
+            'Chapter %d' % i,
+            '-' * len('Chapter %d' % i),
+            '',
+            'Some *emphasis*, some **strong** text, ``literal`` and a note '
+            '[#]_. See `Chapter %d`_.' % max(i - 1, 1),
+            '',
+            '.. [#] The text of footnote %d.' % i,
+            '',
+            '* A bullet',
+            '* Another one',
+            '',
+            'Section',
+            '~~~~~~~',
+            '',
+            '::',
+            '',
+            '    literal block',
+            '',
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def run(doctree, section_cache):
+    settings = frontend.get_default_settings(sile.Writer)
+    settings._update_loose(vars(doctree.settings))
+    settings.section_cache = section_cache
+    doctree.settings = settings
+    visitor = sile.SILETranslator(doctree)
+    start = time.time()
+    doctree.walkabout(visitor)
+    return time.time() - start, ''.join(visitor.doc)
+
+
+def main(sizes):
+    print('%8s %10s %10s %10s' % ('sections', 'no cache', 'cold', 'warm'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sile.SECTION_CACHE = cache_dir
+        for count in sizes:
+            source = make_document(count)
+            times = []
+            outputs = set()
+            for section_cache in (False, True, True):
+                doctree = publish_doctree(
+                    source, settings_overrides={'report_level': 5})
+                elapsed, output = run(doctree, section_cache)
+                times.append(elapsed)
+                outputs.add(output)
+            assert len(outputs) == 1, 'Cached output differs'
+            print('%8d %10.2f %10.2f %10.2f' % ((count, ) + tuple(times)))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100, 1000, 2000])
@@ -3,6 +3,7 @@ setup(
     name='rst2sile',
     version='0.2.3',
     install_requires=open('requirements.txt').readlines(),
+    extras_require={'optimize': ['pikepdf']},
     scripts=['rst2sile', 'rst2pdf'],
     packages=['sile'],
     package_dir={'sile': 'sile'},
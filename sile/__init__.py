@@ -1,11 +1,18 @@
+import codecs
 from collections import defaultdict
 import glob
+import hashlib
+import json
 import os
+import re
+import shutil
 import string
 import subprocess
 import sys
 import tempfile
 import textwrap
+import time
+from xml.sax.saxutils import escape, quoteattr
 
 from docutils import frontend, languages, nodes, writers
 from docutils.parsers.rst import directives
@@ -14,6 +21,13 @@ import tinycss
 
 CSS_FILE = os.path.join(os.path.dirname(__file__), 'styles.css')
 SILE_PATH = os.path.join(os.path.dirname(__file__), 'packages', '*.lua')
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'rst2sile')
+FONT_CACHE = os.path.join(CACHE_DIR, 'fonts.json')
+SECTION_CACHE = os.path.join(CACHE_DIR, 'sections')
+PDF_CACHE = os.path.join(CACHE_DIR, 'pdf')
+PAGE_COUNTS = os.path.join(CACHE_DIR, 'pages.json')
 
 # Units allowed by SILE are different
 directives.length_units = [
@@ -40,7 +54,58 @@ class Writer(writers.Writer):
                   'action': 'store_true',
                   'validator': frontend.validate_boolean,
                   'default': False
-              }), ))
+              }), ('Check that all fonts used by the stylesheets are installed '
+                   'before running SILE. ', ['--check-fonts'], {
+                       'dest': 'check_fonts',
+                       'action': 'store_true',
+                       'validator': frontend.validate_boolean,
+                       'default': False
+                   }), ('Reuse the SILE code of top-level sections that did not '
+                        'change since the last run. ', ['--section-cache'], {
+                            'dest': 'section_cache',
+                            'action': 'store_true',
+                            'validator': frontend.validate_boolean,
+                            'default': False
+                        }), ('Quick preview: images are replaced by placeholders, '
+                             'SILE runs only once and pages are marked as '
+                             'draft. ', ['--draft'], {
+                                 'dest': 'draft',
+                                 'action': 'store_true',
+                                 'validator': frontend.validate_boolean,
+                                 'default': False
+                             }), ('Only render these sections, given as ids or '
+                                  'title paths like "Chapter/Section" (comma '
+                                  'separated). Implies --draft. ',
+                                  ['--draft-sections'], {
+                                      'dest': 'draft_sections',
+                                      'metavar': '<sections>',
+                                      'default': None
+                                  }), ('Linearize the PDF, pack objects in '
+                                       'compressed streams and merge '
+                                       'identical images and fonts (needs '
+                                       'pikepdf). ', ['--optimize-pdf'], {
+                                           'dest': 'optimize_pdf',
+                                           'action': 'store_true',
+                                           'validator':
+                                           frontend.validate_boolean,
+                                           'default': False
+                                       }), ('Syntax of the generated SILE code: '
+                                            '"tex" (default) or "xml". ',
+                                            ['--sile-format'], {
+                                                'dest': 'sile_format',
+                                                'choices': ['tex', 'xml'],
+                                                'metavar': '<format>',
+                                                'default': 'tex'
+                                            }), ('Run SILE and output the '
+                                                 'PDF instead of the SILE '
+                                                 'code (what rst2pdf does). ',
+                                                 ['--output-pdf'], {
+                                                     'dest': 'output_pdf',
+                                                     'action': 'store_true',
+                                                     'validator':
+                                                     frontend.validate_boolean,
+                                                     'default': False
+                                                 }), ))
 
     def __init__(self):
         super(Writer, self).__init__()
@@ -49,6 +114,10 @@ class Writer(writers.Writer):
     def translate(self):
         visitor = self.translator_class(self.document)
         self.document.walkabout(visitor)
+        if visitor.section_cache:
+            hits, total = visitor.cache_hits, visitor.cache_lookups
+            sys.stderr.write('Section cache: %d of %d sections reused (%d%%)\n'
+                             % (hits, total, 100 * hits // max(total, 1)))
         self.output = visitor.astext()
 
 
@@ -71,13 +140,47 @@ class SILETranslator(nodes.NodeVisitor):
         self.list_depth = 0
 
         self.use_docutils_toc = self.settings.use_docutils_toc
+        self.syntax = SYNTAXES[self.settings.sile_format]
+        self.section_cache = self.settings.section_cache
+        # API users can pass their own via settings_overrides
+        self.progress = getattr(self.settings, 'sile_progress',
+                                report_progress)
+        self.cache_hits = 0
+        self.cache_salt = None
+        self.cache_lookups = 0
+
+        self.draft = self.settings.draft or bool(self.settings.draft_sections)
+        # Sections rendered in draft mode and the ones containing them
+        self.draft_keep = None
+        self.draft_path = set()
+        if self.settings.draft_sections:
+            self.draft_keep = set()
+            for selector in self.settings.draft_sections.split(','):
+                section = find_section(document, selector.strip())
+                if section is None:
+                    document.reporter.severe(
+                        'No section matches "%s"' % selector.strip())
+                    continue  # With --halt=none
+                self.draft_keep.add(section)
+                parent = section.parent
+                while parent is not None:
+                    self.draft_path.add(parent)
+                    parent = parent.parent
+            self.draft_keep.update(self.draft_path)
+
+        # Where each PDF destination goes, decided once for the whole document
+        self.targets = build_target_index(document, self.is_drafted)
+        self.target_ids = set()
+        for ids in self.targets.values():
+            self.target_ids.update(ids)
 
         # Pre-load all custom packages to simplify package path / loading
         self.package_code = []
         for package in glob.glob(SILE_PATH):
             p_name = os.path.splitext(package)[0]
             p_name = os.path.join('packages', os.path.basename(p_name))
-            self.package_code.append('\\script[src="%s"]\n' % p_name)
+            self.package_code.append(
+                self.syntax.command('script', src=p_name) + '\n')
 
         css_parser = tinycss.make_parser('page3')
         stylesheets = self.document.settings.stylesheets.split(',')
@@ -101,23 +204,61 @@ class SILETranslator(nodes.NodeVisitor):
                     styles[k] = value
             self.styles.update(styles)
 
+        if self.settings.check_fonts:
+            self.check_fonts()
+
+    def check_fonts(self):
+        """Resolve every font the styles can ask for, stop if one is missing."""
+        if shutil.which('fc-match') is None:
+            self.document.reporter.warning(
+                'fc-match not found, fonts were not checked')
+            return
+        cache = load_font_cache()
+        for selector, font in font_combinations(self.styles):
+            key = '|'.join(font)
+            path = cache.get(key)
+            if path is None or not os.path.isfile(path):
+                path = resolve_font(*font)
+                if path is None:
+                    save_font_cache(cache)
+                    self.document.reporter.severe(
+                        'Font not found for "%s": family=%s, weight=%s, '
+                        'style=%s' % ((selector, ) + font))
+                cache[key] = path
+        save_font_cache(cache)
+
+    def is_drafted(self, node):
+        """Is node part of the selected draft sections (if any)?"""
+        if self.draft_keep is None:
+            return True
+        while node.parent is not None:
+            if node.parent in self.draft_path and not isinstance(
+                    node, (nodes.title, nodes.subtitle)):
+                return node in self.draft_keep
+            node = node.parent
+        return True
+
+    def dispatch_visit(self, node):
+        if (self.draft_keep is not None and isinstance(node, nodes.Element)
+                and node.parent in self.draft_path
+                and not self.is_drafted(node)):
+            raise nodes.SkipNode
+        # Titles place their destinations inside the sectioning command
+        if not isinstance(node, nodes.title):
+            self.add_targets(node)
+        return super(SILETranslator, self).dispatch_visit(node)
+
     def start_cmd(self, envname, **kwargs):
-        opts = format_args(**kwargs)
-        cmd = '\\%s%s{' % (envname, opts)
-        self.doc.append(cmd)
+        self.doc.append(self.syntax.open(envname, **kwargs))
 
-    def end_cmd(self, _=None):
-        self.doc.append('}')
+    def end_cmd(self, envname):
+        self.doc.append(self.syntax.close(envname))
 
     def start_env(self, envname, **kwargs):
-        opts = ''
-        if kwargs:
-            opts = '[%s]' % ','.join('%s=%s' % (k, v)
-                                     for k, v in kwargs.items())
-        self.doc.append('\\begin%s{%s}' % (opts, envname))
+        self.doc.append(self.syntax.begin(envname, **kwargs))
 
     def end_env(self, envname):
-        self.doc.append('\\end{%s}\n\n' % envname)
+        self.doc.append(self.syntax.end(envname) + '\n\n')
 
     def apply_classes(self, node):
         start = ''
@@ -125,8 +266,8 @@ class SILETranslator(nodes.NodeVisitor):
         classes = ['.' + c for c in node.get('classes', [])]
         classes.insert(0, node.__class__.__name__)
         for classname in classes:
-            head, tail = css_to_sile(self.styles[classname])
-            start += '%% %s\n%s' % (classname, head)
+            head, tail = css_to_sile(self.styles[classname], self.syntax)
+            start += self.syntax.comment(classname) + head
             end = tail + end
         self.doc.append(start)
         node.pending_tail = end
@@ -135,30 +276,41 @@ class SILETranslator(nodes.NodeVisitor):
         self.doc.append(node.pending_tail)
 
     def visit_document(self, node):
-        head, tail = css_to_sile(self.styles['body'])
+        head, tail = css_to_sile(self.styles['body'], self.syntax)
 
         scripts = ''.join(self.package_code)
+        s = self.syntax
 
         # TODO: use a custom class
-        self.doc.append('''\\begin[class=book]{document}
-        \\script[src=packages/verbatim]
-        \\script[src=packages/color]
-        \\script[src=packages/rules]
-        \\script[src=packages/pdf]
-        \\script[src=packages/image]
-        \\define[command="verbatim:font"]{\\font%s}
-        \\set[parameter=document.parskip,value=12pt]
-        \\set[parameter=document.parindent,value=0pt]
-        \\script[src=packages/rebox]
-        \\define[command=bullet]{\\rebox[width=0mm]{\\glue[width=-5mm]\\process}}
-        %s
-        %s
-        \n\n''' % (format_args(**self.styles['verbatim']), scripts, head))
+        self.doc.append('\n'.join([
+            s.begin(s.document, **{'class': 'book'}),
+            s.command('script', src='packages/verbatim'),
+            s.command('script', src='packages/color'),
+            s.command('script', src='packages/rules'),
+            s.command('script', src='packages/pdf'),
+            s.command('script', src='packages/image'),
+            s.open('define', command='verbatim:font') +
+            s.command('font', **self.styles['verbatim']) + s.close('define'),
+            s.command('set', parameter='document.parskip', value='12pt'),
+            s.command('set', parameter='document.parindent', value='0pt'),
+            s.command('script', src='packages/rebox'),
+            s.open('define', command='bullet') +
+            s.open('rebox', width='0mm') + s.command('glue', width='-5mm') +
+            s.command('process') + s.close('rebox') + s.close('define'),
+            scripts,
+            head,
+            '\n\n',
+        ]))
+        if self.draft:
+            self.doc.append(
+                s.open('define', command='foliostyle') + s.open('center') +
+                'DRAFT ' + s.command('process') + s.close('center') +
+                s.close('define') + '\n')
         node.pending_tail = tail
 
     def depart_document(self, node):
         self.doc.append(node.pending_tail)
-        self.end_env('document')
+        self.end_env(self.syntax.document)
 
     visit_paragraph = apply_classes
 
@@ -170,14 +322,14 @@ class SILETranslator(nodes.NodeVisitor):
     depart_inline = close_classes
 
     def visit_Text(self, node):
-        text = sile_quote(node.astext())
+        text = self.syntax.quote(node.astext())
         self.doc.append(text)
 
     def depart_Text(self, node):
         pass
 
     def visit_literal(self, node):
-        head, tail = css_to_sile(self.styles['literal'])
+        head, tail = css_to_sile(self.styles['literal'], self.syntax)
         self.doc.append(head)
         node.pending_tail = tail
 
@@ -187,12 +339,14 @@ class SILETranslator(nodes.NodeVisitor):
     def visit_emphasis(self, _):
         self.start_cmd('em')
 
-    depart_emphasis = end_cmd
+    def depart_emphasis(self, _):
+        self.end_cmd('em')
 
     def visit_strong(self, _):
         self.start_cmd('font', weight=800)
 
-    depart_strong = end_cmd
+    def depart_strong(self, _):
+        self.end_cmd('font')
 
     def visit_literal_block(self, _):
         # FIXME: this has horrible vertical separations
@@ -201,11 +355,70 @@ class SILETranslator(nodes.NodeVisitor):
     def depart_literal_block(self, _):
         self.end_env('verbatim')
 
-    def visit_section(self, _):
+    def visit_section(self, node):
+        # Sections only partly rendered for --draft-sections are not cached,
+        # their code depends on the selection
+        if (self.section_cache and self.section_level == 0
+                and node not in self.draft_path):
+            node.cache_key = self.section_key(node)
+            self.cache_lookups += 1
+            try:
+                with open(os.path.join(SECTION_CACHE, node.cache_key)) as f:
+                    self.doc.append(f.read())
+            except IOError:
+                node.cache_start = len(self.doc)
+            else:
+                self.cache_hits += 1
+                # What the skipped visit would have done
+                for anchor in node.cache_anchors:
+                    self.targets.pop(anchor, None)
+                for ref in node.cache_dangling:
+                    self.report_dangling(ref)
+                raise nodes.SkipNode
         self.section_level += 1
 
-    def depart_section(self, _):
+    def depart_section(self, node):
         self.section_level -= 1
+        if hasattr(node, 'cache_start'):
+            write_cache(os.path.join(SECTION_CACHE, node.cache_key),
+                        ''.join(self.doc[node.cache_start:]))
+
+    def section_key(self, node):
+        """Hash everything that affects the SILE code of a section.
+
+        Done in a single pass over the section, which also remembers its
+        anchors and dangling references for when its visit is skipped."""
+        if self.cache_salt is None:
+            self.cache_salt = hashlib.sha256(json.dumps([
+                translator_version(), self.styles, self.use_docutils_toc,
+                self.draft, FOOTNOTE_BATCH, FOOTNOTE_BATCH_CHARS,
+                self.syntax.name
+            ], sort_keys=True).encode('utf-8')).hexdigest()
+        parts = [self.cache_salt]
+        anchors = node.cache_anchors = []
+        dangling = node.cache_dangling = []
+
+        def describe(element):
+            # Things that are not in the element's own attributes too
+            targets = self.targets.get(element)
+            if targets:
+                anchors.append(element)
+            is_dangling = None
+            if isinstance(element, nodes.reference):
+                is_dangling = self.is_dangling(element)
+                if is_dangling:
+                    dangling.append(element)
+            parts.append((element.__class__.__name__, element.attributes,
+                          targets, getattr(element, 'indent', None),
+                          is_dangling, len(element.children)))
+            for child in element.children:
+                if isinstance(child, nodes.Text):
+                    parts.append(str(child))
+                else:
+                    describe(child)
+
+        describe(node)
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
 
     def visit_bullet_list(self, _):
         self.start_cmd('relindent', left="3em")
@@ -213,7 +426,7 @@ class SILETranslator(nodes.NodeVisitor):
 
     def depart_bullet_list(self, _):
         self.list_depth -= 1
-        self.end_cmd()
+        self.end_cmd('relindent')
 
     def visit_list_item(self, node):
         bullet = bullet_for_node(node)
@@ -225,8 +438,8 @@ class SILETranslator(nodes.NodeVisitor):
         bullet = bullets.get(bullet, bullet)
         # FIXME: alignment of arbitrary bullets is suboptimal
         self.start_cmd('bullet')
-        self.doc.append(bullet)
-        self.end_cmd()
+        self.doc.append(self.syntax.quote(bullet))
+        self.end_cmd('bullet')
 
     depart_list_item = noop
 
@@ -243,52 +456,54 @@ class SILETranslator(nodes.NodeVisitor):
 
     def visit_transition(self, _):
         # TODO: style
-        self.doc.append('\n\n\\hrule[width=100%fw, height=0.5pt]\n\n')
+        self.doc.append('\n\n%s\n\n' % self.syntax.command(
+            'hrule', width='100%fw', height='0.5pt'))
 
     depart_transition = noop
 
     def add_target(self, target_id):
         self.start_cmd('pdf:destination', name=target_id)
-        self.end_cmd()
+        self.end_cmd('pdf:destination')
+
+    def add_targets(self, node):
+        for target_id in self.targets.pop(node, []):
+            self.add_target(target_id)
 
     def visit_title(self, node):
         # TODO: do sections as macros because the book class is too limited
         # TODO: handle classes?
 
         if isinstance(node.parent, nodes.topic):  # Topic title
-            head, tail = css_to_sile(self.styles['topic-title'])
+            head, tail = css_to_sile(self.styles['topic-title'], self.syntax)
             self.doc.append(head)
             node.pending_tail = tail
         elif isinstance(node.parent, nodes.sidebar):  # Sidebar title
-            head, tail = css_to_sile(self.styles['sidebar-title'])
+            head, tail = css_to_sile(self.styles['sidebar-title'],
+                                     self.syntax)
             self.doc.append(head)
             node.pending_tail = tail
         elif isinstance(node.parent, nodes.admonition):  # Admonition title
-            head, tail = css_to_sile(self.styles['admonition-title'])
+            head, tail = css_to_sile(self.styles['admonition-title'],
+                                     self.syntax)
             self.doc.append(head)
             node.pending_tail = tail
         elif self.section_level == 0:  # Doc Title
-            head, tail = css_to_sile(self.styles['title'])
+            head, tail = css_to_sile(self.styles['title'], self.syntax)
             self.doc.append(head)
             node.pending_tail = tail
         elif self.section_level == 1:
             self.start_cmd('chapter')
-            node.pending_tail = '}'
+            node.pending_tail = self.syntax.close('chapter')
         elif self.section_level == 2:
             self.start_cmd('section')
-            node.pending_tail = '}'
+            node.pending_tail = self.syntax.close('section')
         elif self.section_level == 3:
             self.start_cmd('subsection')
-            node.pending_tail = '}'
+            node.pending_tail = self.syntax.close('subsection')
         else:
             raise Exception('Too deep')
-        # target for this title
-        if 'refid' in node:
-            self.add_target(node['refid'])
         # targets for the section in which this title is
-        if isinstance(node.parent, nodes.section):
-            for node_id in node.parent['ids']:
-                self.add_target(node_id)
+        self.add_targets(node)
 
     def depart_title(self, node):
         self.close_classes(node)
@@ -299,7 +514,8 @@ class SILETranslator(nodes.NodeVisitor):
         if self.section_level == 0:  # Doc SubTitle
             self.apply_classes(node)
         elif isinstance(node.parent, nodes.sidebar):  # Sidebar subtitle
-            head, tail = css_to_sile(self.styles['sidebar-subtitle'])
+            head, tail = css_to_sile(self.styles['sidebar-subtitle'],
+                                     self.syntax)
             self.doc.append(head)
             node.pending_tail = tail
         else:
@@ -319,7 +535,7 @@ class SILETranslator(nodes.NodeVisitor):
 
     # TODO: implement raw SILE
     def visit_raw(self, node):
-        if node['format'] != 'sile':
+        if node['format'] != self.syntax.raw_format:
             raise nodes.SkipNode
         else:
             self.doc.append(node.astext())
@@ -336,8 +552,8 @@ class SILETranslator(nodes.NodeVisitor):
             # FIXME: local tocs are docutils-based and look bad
             if not self.use_docutils_toc and 'local' not in node['classes']:
                 self.start_cmd('define', command='tableofcontents:title')
-                self.doc.append(node.next_node().astext())
-                self.end_cmd()
+                self.doc.append(self.syntax.quote(node.next_node().astext()))
+                self.end_cmd('define')
                 for command, style in {
                         "tableofcontents:headerfont": 'toc-header',
                         "tableofcontents:level1item": 'toc-l1',
@@ -345,12 +561,14 @@ class SILETranslator(nodes.NodeVisitor):
                         "tableofcontents:level3item": 'toc-l3'
                 }.items():
                     self.start_cmd('define', command=command)
-                    head, tail = css_to_sile(self.styles[style])
+                    head, tail = css_to_sile(self.styles[style], self.syntax)
                     self.doc.append(head)
-                    self.doc.append('\\process\\break')
+                    self.doc.append(self.syntax.command('process') +
+                                    self.syntax.command('break'))
                     self.doc.append(tail + '\n')
-                    self.end_cmd()
-                node.pending_tail = '\\tableofcontents' + node.pending_tail
+                    self.end_cmd('define')
+                node.pending_tail = (self.syntax.command('tableofcontents') +
+                                     node.pending_tail)
                 raise nodes.SkipChildren
 
     depart_topic = close_classes
@@ -361,10 +579,10 @@ class SILETranslator(nodes.NodeVisitor):
 
     def visit_docinfo_node(self, node, name):
         self.apply_classes(node)
-        self.doc.append(self.language.labels[name])
+        self.doc.append(self.syntax.quote(self.language.labels[name]))
         self.doc.append(': ')
         self.close_classes(node)
-        self.doc.append(node.astext())
+        self.doc.append(self.syntax.quote(node.astext()))
         raise nodes.SkipNode
 
     depart_docinfo_node = noop
@@ -385,7 +603,7 @@ class SILETranslator(nodes.NodeVisitor):
     def visit_author(self, node):
         if isinstance(node.parent, nodes.authors):
             if self.author_in_authors:
-                self.doc.append('\\break ')
+                self.doc.append(self.syntax.command('break') + ' ')
         else:
             self.visit_docinfo_node(node, 'author')
 
@@ -455,12 +673,12 @@ class SILETranslator(nodes.NodeVisitor):
         adm_style = self.styles.get(_name, self.styles['admonition'])
         title_style = self.styles.get(_name + '-title',
                                       self.styles['admonition-title'])
-        head1, tail1 = css_to_sile(adm_style)
+        head1, tail1 = css_to_sile(adm_style, self.syntax)
         self.doc.append(head1)
         if _name:  # Generic admonitions have no name
-            head2, tail2 = css_to_sile(title_style)
+            head2, tail2 = css_to_sile(title_style, self.syntax)
             self.doc.append(head2)
-            self.doc.append(name)
+            self.doc.append(self.syntax.quote(name))
             self.doc.append(tail2)
         node.pending_tail = tail1
 
@@ -516,14 +734,16 @@ class SILETranslator(nodes.NodeVisitor):
         self.apply_classes(node)
 
     def depart_superscript(self, node):
-        self.end_cmd()
         self.close_classes(node)
+        self.end_cmd('raise')
 
     def visit_subscript(self, node):
         self.start_cmd('lower', height='.25em')
         self.apply_classes(node)
 
-    depart_subscript = depart_superscript
+    def depart_subscript(self, node):
+        self.close_classes(node)
+        self.end_cmd('lower')
 
     # TODO: footnote links
     visit_footnote_reference = visit_superscript
@@ -533,15 +753,31 @@ class SILETranslator(nodes.NodeVisitor):
     depart_citation_reference = depart_footnote_reference
 
     def visit_footnote(self, node):
-        self.start_cmd('footnote')
+        # Consecutive footnotes go into SILE as a single insertion
+        if not getattr(node, 'batched', False):
+            batch = footnote_batch(node)
+            for note in batch[1:]:
+                note.batched = True
+            batch[-1].ends_batch = True
+            if len(batch) > 1:
+                self.start_cmd('footnote', count=len(batch))
+            else:
+                self.start_cmd('footnote')
+        else:
+            self.doc.append('\n\n')
         self.apply_classes(node)
 
     def depart_footnote(self, node):
-        self.end_cmd()
         self.close_classes(node)
+        if getattr(node, 'ends_batch', False):
+            self.end_cmd('footnote')
+
+    # Citations are a bibliography, typeset where they are, not as footnotes
+    visit_citation = apply_classes
 
-    visit_citation = visit_footnote
-    depart_citation = depart_footnote
+    def depart_citation(self, node):
+        self.close_classes(node)
+        self.doc.append('\n\n')
 
     def visit_label(self, node):
         self.apply_classes(node)
@@ -555,25 +791,56 @@ class SILETranslator(nodes.NodeVisitor):
 
     def astext(self):
         sile_code = ''.join(self.doc)
-        if sys.argv[0].endswith('rst2pdf'):
-            with tempfile.NamedTemporaryFile('w') as sil_file:
+        if self.settings.output_pdf:
+            with tempfile.NamedTemporaryFile(
+                    'w', suffix=self.syntax.suffix) as sil_file:
                 sil_file.write(sile_code)
+                sil_file.flush()
                 pdf_path = sil_file.name + '.pdf'
-                toc_path = sil_file.name + '.toc'
+                # SILE names the TOC after the input, minus its extension
+                toc_path = os.path.splitext(sil_file.name)[0] + '.toc'
                 env = os.environ.copy()
                 env['SILE_PATH'] = os.path.dirname(__file__)
-                subprocess.check_call(
-                    ['sile', sil_file.name, '-o', pdf_path], env=env)
+                # The first pass has no page count of its own, use the
+                # one from the last build of this document, if any
+                source = self.document.get('source') or ''
+                if os.path.isfile(source):
+                    source = os.path.abspath(source)
+                else:
+                    source = None  # Nothing to remember it by
+                page_counts = load_page_counts()
+                pages = run_sile(sil_file.name, pdf_path, env, 1,
+                                 page_counts.get(source), self.progress)
+                if source:
+                    page_counts[source] = pages
+                    write_cache(PAGE_COUNTS, json.dumps(page_counts))
                 if os.path.isfile(
                         toc_path
-                ) and not self.use_docutils_toc:  # Need to run twice
-                    subprocess.check_call(
-                        ['sile', sil_file.name, '-o', pdf_path], env=env)
+                ) and not (self.use_docutils_toc or
+                           self.draft):  # Need to run twice
+                    run_sile(sil_file.name, pdf_path, env, 2, pages,
+                             self.progress)
             with open(pdf_path, 'rb') as pdf_file:
-                return pdf_file.read()
+                pdf = pdf_file.read()
+            if self.settings.optimize_pdf:
+                pdf = self.optimize(pdf)
+            return pdf
         else:
             return sile_code
 
+    def optimize(self, pdf):
+        try:
+            from sile.optimize import optimize_pdf
+        except ImportError:
+            self.document.reporter.severe(
+                '--optimize-pdf needs pikepdf (pip install pikepdf)')
+            return pdf  # With --halt=none
+        optimized = optimize_pdf(pdf, PDF_CACHE)
+        sys.stderr.write('Optimized PDF: %d bytes, %d%% smaller\n' %
+                         (len(optimized),
+                          100 - 100 * len(optimized) // max(len(pdf), 1)))
+        return optimized
+
     visit_definition_list = noop
     depart_definition_list = noop
     visit_definition_list_item = noop
@@ -599,17 +866,18 @@ class SILETranslator(nodes.NodeVisitor):
 
     def depart_option_list(self, node):
         self.start_env('verbatim')
+        quote = self.syntax.quote
         oplen = max(len(r[0]) for r in node.table) + 2
         for row in node.table:
             # The option itself
             option = row[0] + ' ' * (oplen - len(row[0]))
             if len(row) > 1:
                 desclines = [line.strip() for line in row[1].splitlines()]
-                self.doc.append(option + desclines[0] + '\n')
+                self.doc.append(quote(option + desclines[0]) + '\n')
                 for line in desclines[1:]:
-                    self.doc.append(' ' * oplen + line + '\n')
+                    self.doc.append(' ' * oplen + quote(line) + '\n')
             else:
-                self.doc.append(option + '\n')
+                self.doc.append(quote(option) + '\n')
         self.end_env('verbatim')
 
     visit_option_group = noop
@@ -639,22 +907,34 @@ class SILETranslator(nodes.NodeVisitor):
 
     def visit_reference(self, node):
         self.apply_classes(node)
+        node.link_tail = self.syntax.close('pdf:link')
         if 'refuri' in node:
             # FIXME: external links are broken
             self.start_cmd('pdf:link', dest=node['refuri'], external="true")
-        else:
+        elif not self.is_dangling(node):
             self.start_cmd('pdf:link', dest=node['refid'])
+        else:
+            # Nothing to link to, keep the text but don't bother SILE
+            self.report_dangling(node)
+            node.link_tail = ''
+
+    def is_dangling(self, node):
+        return 'refuri' not in node and node.get('refid') not in self.target_ids
+
+    def report_dangling(self, node):
+        if self.draft_keep is not None and node.get('refid') in self.document.ids:
+            return  # Exists, just not in this draft
+        self.document.reporter.warning(
+            'Dangling reference to "%s"' %
+            node.get('refid', node.get('refname', node.astext())),
+            base_node=node)
 
     def depart_reference(self, node):
-        self.end_cmd()
+        self.doc.append(node.link_tail)
         self.close_classes(node)
 
-    def visit_target(self, node):
-        if 'refid' in node:
-            self.add_target(node['refid'])
-        for _id in node.get('ids', []):
-            self.add_target(_id)
-
+    # Destinations are placed by dispatch_visit, see build_target_index
+    visit_target = noop
     depart_target = noop
 
     # FIXME: standalone image directives appear inline with next paragraph stuck
@@ -668,10 +948,21 @@ class SILETranslator(nodes.NodeVisitor):
                 args['width'] += 'fw'
         if 'height' in node:
             args['height'] = node['height']
-        self.start_cmd('img', **args)
+        if self.draft:
+            # Same size, if we know it, but nothing to load
+            head, tail = css_to_sile(self.styles['image-placeholder'],
+                                     self.syntax)
+            self.doc.append(head + self.syntax.command(
+                'hrule',
+                width=args.get('width', '50%fw'),
+                height=args.get('height', '3cm')) + tail)
+            node.image_tail = ''
+        else:
+            self.start_cmd('img', **args)
+            node.image_tail = self.syntax.close('img')
 
     def depart_image(self, node):
-        self.end_cmd()
+        self.doc.append(node.image_tail)
         self.close_classes(node)
 
     visit_figure = apply_classes
@@ -700,14 +991,17 @@ class SILETranslator(nodes.NodeVisitor):
     depart_line_block = close_classes
 
     def visit_line(self, node):
-        self.doc.append('\\glue[width=%dem]' % node.indent)
+        self.doc.append(
+            self.syntax.command('glue', width='%dem' % node.indent))
         if not node.astext():
             # Adding unbreakable space because of
             # https://github.com/simoncozens/sile/issues/479
             self.doc.append('\u00A0')
 
     def depart_line(self, node):
-        self.doc.append('\\glue[width=0mm plus 100%fw]\\break\n')
+        self.doc.append(
+            self.syntax.command('glue', width='0mm plus 100%fw') +
+            self.syntax.command('break') + '\n')
 
     # TODO: implement these
     visit_title_reference = noop
@@ -736,6 +1030,201 @@ class SILETranslator(nodes.NodeVisitor):
     depart_entry = noop
 
 
+_translator_version = []
+
+
+def translator_version():
+    """Hash of this module, so cached output is dropped when it changes."""
+    if not _translator_version:
+        with open(__file__, 'rb') as source:
+            _translator_version.append(hashlib.sha256(source.read()).hexdigest())
+    return _translator_version[0]
+
+
+# SILE prints [n] as it ships each page
+PAGE_RE = re.compile(r'\[(\d+)\]')
+
+
+def run_sile(sil_path, pdf_path, env, sile_pass, total_pages, progress):
+    """Run SILE, calling progress with a dict for every page it finishes.
+
+    The dict has the current pass, pages rendered so far, pages per second
+    and, when total_pages is known from an earlier pass or build, an ETA in
+    seconds.
+    A last one with done=True is sent when SILE exits. Returns the number
+    of pages."""
+    start = time.time()
+    proc = subprocess.Popen(['sile', sil_path, '-o', pdf_path],
+                            env=env,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    pages = 0
+    pending = ''
+    message = ''
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def event(done):
+        elapsed = time.time() - start
+        rate = pages / elapsed if elapsed else 0.0
+        eta = None
+        if total_pages and rate:
+            eta = max(total_pages - pages, 0) / rate
+        progress({
+            'pass': sile_pass,
+            'pages': pages,
+            'total_pages': total_pages,
+            'pages_per_second': rate,
+            'elapsed': elapsed,
+            'eta': eta,
+            'done': done,
+        })
+
+    while True:
+        # Page markers are not followed by newlines, so don't wait for them
+        chunk = os.read(proc.stdout.fileno(), 1024)
+        if not chunk:
+            break
+        text = pending + decoder.decode(chunk)
+        # A marker may be cut in half, keep that part for the next chunk
+        cut = text.rfind('[')
+        if cut != -1 and ']' not in text[cut:] and len(text) - cut < 16:
+            text, pending = text[:cut], text[cut:]
+        else:
+            pending = ''
+        for match in PAGE_RE.finditer(text):
+            pages = int(match.group(1))
+            event(False)
+        # Anything else SILE says (warnings, errors) is passed along, a
+        # line at a time so lines split between reads stay whole
+        message += PAGE_RE.sub('', text)
+        lines, _, message = message.rpartition('\n')
+        write_messages(lines)
+    # Whatever SILE said last, even without a newline
+    write_messages(message + pending + decoder.decode(b'', final=True))
+    proc.stdout.close()
+    returncode = proc.wait()
+    event(True)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, proc.args)
+    return pages
+
+
+def write_messages(text):
+    """Pass SILE's non-empty output lines along to stderr."""
+    for line in text.splitlines():
+        if line.strip():
+            sys.stderr.write(line.strip() + '\n')
+
+
+def report_progress(event):
+    """Default progress reporter, a status line on stderr."""
+    line = 'SILE pass %d: %d pages, %.1f pages/s' % (
+        event['pass'], event['pages'], event['pages_per_second'])
+    if event['eta'] is not None:
+        line += ', ETA %ds' % event['eta']
+    sys.stderr.write('\r' + line + ('\n' if event['done'] else ''))
+    sys.stderr.flush()
+
+
+# Most footnotes SILE gets in a single insertion. Bigger batches mean
+# less work for SILE, but a batch is a single box that can't be split across
+# pages, so the total text in one is limited too. A footnote longer than
+# that still gets an insertion of its own, as it always did.
+FOOTNOTE_BATCH = 8
+FOOTNOTE_BATCH_CHARS = 600
+
+
+def footnote_batch(node):
+    """Return node and the footnotes right after it that share its batch."""
+    batch = [node]
+    size = len(node.astext())
+    sibling = node.next_node(descend=False, siblings=True)
+    while isinstance(sibling, nodes.footnote) and len(batch) < FOOTNOTE_BATCH:
+        size += len(sibling.astext())
+        if size > FOOTNOTE_BATCH_CHARS:
+            break
+        batch.append(sibling)
+        sibling = sibling.next_node(descend=False, siblings=True)
+    return batch
+
+
+# Subtrees the translator never renders, destinations there would be lost
+UNRENDERED_NODES = (nodes.comment, nodes.decoration, nodes.generated,
+                    nodes.raw, nodes.option_list_item)
+
+
+def build_target_index(document, rendered=lambda node: True):
+    """Map each node that should carry PDF destinations to their ids.
+
+    Section ids, explicit target ids and ids something links to get a
+    destination, each of them exactly once: sections anchor on their title
+    and indirect targets on whatever they finally point to. Ids that can't
+    be anchored, including those that end up at an external URL, are left
+    out so references to them can be reported as dangling."""
+    wanted = []
+    for node in document.findall(nodes.section):
+        wanted.extend(node['ids'])
+    # Explicit targets are kept even if unused, for links from outside (#id)
+    for node in document.findall(nodes.target):
+        if 'refuri' not in node:
+            wanted.extend(node['ids'])
+            if 'refid' in node:
+                wanted.append(node['refid'])
+    for node in document.findall(nodes.reference):
+        if 'refid' in node:
+            wanted.append(node['refid'])
+    if document.get('title'):
+        wanted.extend(document['ids'])
+
+    index = {}
+    seen = set()
+    for target_id in wanted:
+        if target_id in seen:
+            continue
+        seen.add(target_id)
+        anchor = document.ids.get(target_id)
+        # Follow chains of indirect targets
+        hops = set()
+        while (isinstance(anchor, nodes.target) and 'refid' in anchor
+               and id(anchor) not in hops):
+            hops.add(id(anchor))
+            anchor = document.ids.get(anchor['refid'])
+        if isinstance(anchor, nodes.target) and 'refuri' in anchor:
+            anchor = None  # Points outside the document
+        if isinstance(anchor, (nodes.document, nodes.section)):
+            if anchor.children and isinstance(anchor[0], nodes.title):
+                anchor = anchor[0]
+            else:
+                anchor = None
+        if anchor is None or not (is_rendered(anchor) and rendered(anchor)):
+            continue
+        index.setdefault(anchor, []).append(target_id)
+    return index
+
+
+def find_section(document, selector):
+    """Find a section by id or by title path ('Chapter/Section')."""
+    node = document.ids.get(selector)
+    if isinstance(node, nodes.section):
+        return node
+    candidates = [document]
+    for title in selector.split('/'):
+        candidates = [
+            child for parent in candidates for child in parent.children
+            if isinstance(child, nodes.section) and child.children
+            and child[0].astext().strip() == title.strip()
+        ]
+    return candidates[0] if candidates else None
+
+
+def is_rendered(node):
+    while node is not None:
+        if isinstance(node, UNRENDERED_NODES):
+            return False
+        node = node.parent
+    return True
+
+
 # Originally from rst2pdf
 def bullet_for_node(node):
     """Takes a node, assumes it's some sort of
@@ -781,10 +1270,12 @@ def sile_quote(text):
         }))
 
 
-def css_to_sile(style):
+def css_to_sile(style, syntax=None):
     """Given a CSS-like style, create a SILE environment."""
+    syntax = syntax or TeXSyntax
 
-    font_keys = {'script', 'language', 'style', 'weight', 'family', 'size'}
+    # A tuple, not a set, so the generated code doesn't change between runs
+    font_keys = ('script', 'language', 'style', 'weight', 'family', 'size')
     margin_keys = {
         'margin-left', 'margin-right', 'margin-top', 'margin-bottom'
     }
@@ -801,49 +1292,234 @@ def css_to_sile(style):
 
     if has_margin:
         if 'margin-top' in keys:
-            start += '\\skip[height=%s]' % style['margin-top']
+            start += syntax.command('skip', height=style['margin-top'])
         if 'margin-bottom' in keys:
-            trailer = '\\skip[height=%s]' % style['margin-bottom'] + trailer
+            trailer = syntax.command(
+                'skip', height=style['margin-bottom']) + trailer
         if 'margin-right' in keys:
-            start += '\\relindent[right=%s]{' % style['margin-right']
-            trailer = '}' + trailer
+            start += syntax.open('relindent', right=style['margin-right'])
+            trailer = syntax.close('relindent') + trailer
         if 'margin-left' in keys:
-            start += '\\relindent[left=%s]{' % style['margin-left']
-            trailer = '}' + trailer
+            start += syntax.open('relindent', left=style['margin-left'])
+            trailer = syntax.close('relindent') + trailer
 
     if has_alignment:
         value = style['text-align']
         if value == 'right':
-            start += '\\begin{raggedleft}'
-            trailer = '\\end{raggedleft}' + trailer
+            start += syntax.begin('raggedleft')
+            trailer = syntax.end('raggedleft') + trailer
         elif value == 'center':
-            start += '\\begin{center}'
-            trailer = '\\end{center}' + trailer
+            start += syntax.begin('center')
+            trailer = syntax.end('center') + trailer
         elif value in ['left']:
-            start += '\\begin{raggedright}'
-            trailer = '\\end{raggedright}' + trailer
+            start += syntax.begin('raggedright')
+            trailer = syntax.end('raggedright') + trailer
         # Fully justified is default
 
     if has_font:
-        opts = ','.join('%s=%s' % (k, style[k]) for k in font_keys
-                        if k in style)
-        head = '\\font[%s]{' % opts
-        start += head
-        trailer = '}' + trailer
+        start += syntax.open('font',
+                             **{k: style[k]
+                                for k in font_keys if k in style})
+        trailer = syntax.close('font') + trailer
 
     if has_indent:
-        start += '\\set[parameter=document.parindent,value=%s]' % style[
-            'text-indent']
+        start += syntax.command('set',
+                                parameter='document.parindent',
+                                value=style['text-indent'])
 
     if has_color:
-        start += '\\color[color=%s]{' % style['color']
-        trailer = '}' + trailer
+        start += syntax.open('color', color=style['color'])
+        trailer = syntax.close('color') + trailer
 
     return start, trailer
 
 
+# SILE weights are CSS-like numbers, fontconfig wants its own names
+FC_WEIGHTS = {
+    '100': 'thin',
+    '200': 'extralight',
+    '300': 'light',
+    '400': 'regular',
+    '500': 'medium',
+    '600': 'demibold',
+    '700': 'bold',
+    '800': 'extrabold',
+    '900': 'black',
+}
+
+
+def font_combinations(styles):
+    """List (selector, (family, weight, style)) for every font in styles.
+
+    Fonts nest in SILE, missing properties come from the enclosing style
+    and finally from body. Every style with font properties is checked
+    inside body and inside each of the others (one level deep), and so
+    are emphasis and strong, which can appear inside any of them."""
+    font_keys = ('family', 'weight', 'style')
+    defaults = {'family': 'Gentium Plus', 'weight': '400', 'style': 'normal'}
+
+    def nest(*nested):
+        font = dict(defaults)
+        for style in nested:
+            font.update((k, v) for k, v in style.items() if k in font_keys)
+        return tuple(font[k] for k in font_keys)
+
+    styled = [(selector, style) for selector, style in sorted(styles.items())
+              if set(font_keys).intersection(style)]
+    inline = [('emphasis', {'style': 'italic'}),
+              ('strong', {'weight': '800'}),
+              ('strong emphasis', {'style': 'italic', 'weight': '800'})]
+    body = styles['body']
+    result = []
+    for outer, outer_style in [('body', body)] + styled:
+        result.append((outer, nest(body, outer_style)))
+        for inner, inner_style in inline + styled:
+            if outer != 'body':
+                inner = '%s inside %s' % (inner, outer)
+            result.append((inner, nest(body, outer_style, inner_style)))
+    seen = set()
+    return [(selector, font) for selector, font in result
+            if not (font in seen or seen.add(font))]
+
+
+def resolve_font(family, weight, style):
+    """Return the path of the font fontconfig would use, or None."""
+    family = family.strip('"\'')
+    pattern = '%s:weight=%s' % (family.replace('-', '\\-'),
+                                 FC_WEIGHTS.get(weight, weight))
+    if style == 'italic':
+        pattern += ':slant=italic'
+    try:
+        output = subprocess.check_output(
+            ['fc-match', '-f', '%{family}\n%{file}', pattern],
+            universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    families, _, path = output.partition('\n')
+    # fc-match always falls back to something, that doesn't count
+    if family.lower() not in [f.strip().lower() for f in families.split(',')]:
+        return None
+    return path
+
+
+def load_page_counts():
+    try:
+        with open(PAGE_COUNTS) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def load_font_cache():
+    try:
+        with open(FONT_CACHE) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_font_cache(cache):
+    write_cache(FONT_CACHE, json.dumps(cache, indent=1, sort_keys=True))
+
+
+def write_cache(path, data):
+    """Write data (str or bytes) to a cache file, if possible.
+
+    The file is written elsewhere and then renamed, so concurrent builds
+    sharing the cache never see it half-written. Caches only save time, so
+    failing to write one is not an error."""
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'wb' if isinstance(data, bytes) else 'w',
+                dir=os.path.dirname(path),
+                prefix='.tmp',
+                delete=False) as f:
+            tmp_path = f.name
+            f.write(data)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
 def format_args(**kwargs):
     opts = ''
     if kwargs:
         opts = '[%s]' % ','.join('%s=%s' % (k, v) for k, v in kwargs.items())
     return opts
+
+
+class TeXSyntax(object):
+    """SILE's TeX-like input format."""
+
+    name = 'tex'
+    document = 'document'
+    raw_format = 'sile'
+    suffix = ''
+    quote = staticmethod(sile_quote)
+
+    @staticmethod
+    def command(envname, **kwargs):
+        """A command without content."""
+        return '\\%s%s' % (envname, format_args(**kwargs))
+
+    @classmethod
+    def open(cls, envname, **kwargs):
+        return cls.command(envname, **kwargs) + '{'
+
+    @staticmethod
+    def close(_):
+        return '}'
+
+    @staticmethod
+    def begin(envname, **kwargs):
+        return '\\begin%s{%s}' % (format_args(**kwargs), envname)
+
+    @staticmethod
+    def end(envname):
+        return '\\end{%s}' % envname
+
+    @staticmethod
+    def comment(text):
+        return '%% %s\n' % text
+
+
+class XMLSyntax(object):
+    """SILE's XML input format, where environments are just elements."""
+
+    name = 'xml'
+    document = 'sile'
+    raw_format = 'sile-xml'
+    # SILE picks the input format by extension
+    suffix = '.xml'
+    quote = staticmethod(escape)
+
+    @staticmethod
+    def attributes(**kwargs):
+        # CSS values may be quoted ("DejaVu Sans"), XML adds its own
+        return ''.join(' %s=%s' % (k, quoteattr(str(v).strip('"\'')))
+                       for k, v in kwargs.items())
+
+    @classmethod
+    def command(cls, envname, **kwargs):
+        return '<%s%s/>' % (envname, cls.attributes(**kwargs))
+
+    @classmethod
+    def open(cls, envname, **kwargs):
+        return '<%s%s>' % (envname, cls.attributes(**kwargs))
+
+    @staticmethod
+    def close(envname):
+        return '</%s>' % envname
+
+    begin = open
+    end = close
+
+    @staticmethod
+    def comment(text):
+        return '<!-- %s -->\n' % text.replace('--', '- -')
+
+
+SYNTAXES = {syntax.name: syntax for syntax in (TeXSyntax, XMLSyntax)}
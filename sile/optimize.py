@@ -0,0 +1,146 @@
+"""Post-processing of SILE's PDFs for delivery.
+
+Identical images and embedded fonts are merged into a single object, then
+the PDF is saved linearized ("fast web view") with objects packed into
+compressed object streams. Needs pikepdf (pip install rst2sile[optimize]).
+
+Results are cached by the hash of the input PDF (and of this module and
+the pikepdf version, so fixes here aren't hidden by old results), so
+rebuilding a document that didn't change doesn't optimize it again.
+"""
+
+import hashlib
+import io
+import os
+
+import pikepdf
+
+from sile import write_cache
+
+FONT_FILES = ('/FontFile', '/FontFile2', '/FontFile3')
+
+
+def optimize_pdf(data, cache_dir=None):
+    """Return an optimized version of the PDF in data (bytes)."""
+    cache_path = None
+    if cache_dir:
+        key = hashlib.sha256(optimizer_version().encode('utf-8'))
+        key.update(data)
+        cache_path = os.path.join(cache_dir, key.hexdigest() + '.pdf')
+        try:
+            with open(cache_path, 'rb') as cached:
+                return cached.read()
+        except IOError:
+            pass
+
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        dedupe_resources(pdf)
+        output = io.BytesIO()
+        pdf.save(output,
+                 linearize=True,
+                 compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    result = output.getvalue()
+
+    if cache_path:
+        write_cache(cache_path, result)
+    return result
+
+
+_optimizer_version = []
+
+
+def optimizer_version():
+    """Hash of this module and the pikepdf version it runs with."""
+    if not _optimizer_version:
+        with open(__file__, 'rb') as source:
+            key = hashlib.sha256(source.read())
+        key.update(pikepdf.__version__.encode('utf-8'))
+        _optimizer_version.append(key.hexdigest())
+    return _optimizer_version[0]
+
+
+def stream_key(stream, _stack=()):
+    """Something equal for streams with the same content and dictionary."""
+    key = hashlib.sha256(stream.read_raw_bytes())
+    for name in sorted(stream.keys()):
+        if name == '/Length':
+            continue
+        key.update(('%s=%s' % (name, value_key(stream[name], _stack + (
+            stream.objgen, )))).encode('utf-8'))
+    return key.hexdigest()
+
+
+def value_key(value, stack):
+    """Like stream_key, for any value in a stream's dictionary.
+
+    Streams nested anywhere in it (a soft mask, the palette of an indexed
+    color space, an ICC profile) count with their whole content."""
+    if isinstance(value, pikepdf.Object) and value.is_indirect:
+        if value.objgen in stack:  # Loops back, nothing new there
+            return 'R%d.%d' % value.objgen
+        stack += (value.objgen, )
+    if isinstance(value, pikepdf.Stream):
+        return 'S' + stream_key(value, stack)
+    if isinstance(value, pikepdf.Array):
+        return '[%s]' % ' '.join(value_key(item, stack) for item in value)
+    if isinstance(value, pikepdf.Dictionary):
+        return '<<%s>>' % ' '.join(
+            '%s %s' % (name, value_key(value[name], stack))
+            for name in sorted(value.keys()))
+    if isinstance(value, pikepdf.Object):
+        return value.unparse().decode('latin-1')
+    return repr(value)
+
+
+def dedupe_resources(pdf):
+    """Point every use of an image or font file to a single copy of it.
+
+    The copies that are no longer used are not written when saving."""
+    seen = {}
+
+    def canonical(stream):
+        return seen.setdefault(stream_key(stream), stream)
+
+    def canonical_dict(obj):
+        # Only once whatever they point to has been deduplicated
+        if not obj.is_indirect:
+            return obj
+        return seen.setdefault(obj.unparse(resolved=True), obj)
+
+    def dedupe_font(font):
+        descendants = font.get('/DescendantFonts')
+        for descendant in (descendants if descendants is not None else []):
+            dedupe_font(descendant)
+        if descendants is not None:
+            for i, descendant in enumerate(descendants):
+                descendants[i] = canonical_dict(descendant)
+        if '/ToUnicode' in font:
+            font.ToUnicode = canonical(font.ToUnicode)
+        descriptor = font.get('/FontDescriptor')
+        if descriptor is not None:
+            for key in FONT_FILES:
+                if key in descriptor:
+                    descriptor[key] = canonical(descriptor[key])
+            font.FontDescriptor = canonical_dict(descriptor)
+
+    def dedupe(resources, done):
+        if resources is None or resources.objgen in done:
+            return
+        if resources.objgen != (0, 0):
+            done.add(resources.objgen)
+        xobjects = resources.get('/XObject', {})
+        for name in list(xobjects.keys()):
+            xobject = xobjects[name]
+            if xobject.get('/Subtype') == '/Image':
+                xobjects[name] = canonical(xobject)
+            elif xobject.get('/Subtype') == '/Form':
+                dedupe(xobject.get('/Resources'), done)
+        fonts = resources.get('/Font', {})
+        for name in list(fonts.keys()):
+            dedupe_font(fonts[name])
+            fonts[name] = canonical_dict(fonts[name])
+
+    done = set()
+    for page in pdf.pages:
+        dedupe(page.obj.get('/Resources'), done)
@@ -33,14 +33,22 @@ SILE.registerCommand("footnote:options", function(options, content)
   end
 end)
 
+-- rst2sile batches consecutive footnotes into a single \footnote (count
+-- tells how many), so there is one insertion per batch instead of one per
+-- note. The typesetter used to build them is also created only once.
+local footnoteTypesetter
+
 SILE.registerCommand("footnote", function(options, content)
   SILE.call("footnotemark")
   local opts = SILE.scratch.insertions.classes.footnote
   local f = SILE.getFrame(opts["insertInto"].frame)
+  if not footnoteTypesetter then
+    footnoteTypesetter = SILE.typesetter {}
+    footnoteTypesetter.pageTarget = function () return 0xFFFFFF end
+  end
   local oldT = SILE.typesetter
-  SILE.typesetter = SILE.typesetter {}
+  SILE.typesetter = footnoteTypesetter
   SILE.typesetter:init(f)
-  SILE.typesetter.pageTarget = function () return 0xFFFFFF end
   SILE.settings.pushState()
   SILE.settings.reset()
   local material = SILE.Commands["vbox"]({}, function()
@@ -53,7 +61,8 @@ SILE.registerCommand("footnote", function(options, content)
   SILE.settings.popState()
   SILE.typesetter = oldT
   insertions.exports:insert("footnote", material)
-  SILE.scratch.counters.footnote.value = SILE.scratch.counters.footnote.value + 1
+  local count = tonumber(options.count) or 1
+  SILE.scratch.counters.footnote.value = SILE.scratch.counters.footnote.value + count
 end)
 
 SILE.registerCommand("footnote:font", function(options, content)
@@ -0,0 +1,402 @@
+"""Parallel parsing of large reStructuredText sources.
+
+The source is split before the titles of its top-level sections (the
+shallowest level that has more than one section) and the chunks are parsed
+in a process pool. While parsing a chunk, ids, names, substitutions,
+footnotes and so on are only recorded, not resolved. The chunks are then
+put back together into a single doctree and those registrations replayed in
+the original order, so ids, duplicate names, footnote numbering and
+references come out exactly as when parsing in a single process.
+
+Whenever that can't be guaranteed (directives that change the parser's
+state, unexpected structure) the source is parsed in a single process
+instead.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import re
+
+from docutils import frontend, nodes, statemachine, utils
+from docutils.parsers import rst
+from docutils.parsers.rst import states
+
+# Directives that affect what comes after them in ways a chunk can't see
+STATEFUL_DIRECTIVES = re.compile(
+    r'^\.\.\s+(role|default-role|title|header|footer|include|meta)::',
+    re.MULTILINE)
+
+# A line made of a single repeated punctuation character
+ADORNMENT = re.compile(r'([!-/:-@[-`{-~])\1* *$')
+
+# Document methods that register things, replayed after merging
+RECORDED = ('set_id', 'note_implicit_target', 'note_explicit_target',
+            'note_refname', 'note_refid', 'note_indirect_target',
+            'note_anonymous_target', 'note_autofootnote',
+            'note_autofootnote_ref', 'note_symbol_footnote',
+            'note_symbol_footnote_ref', 'note_footnote', 'note_footnote_ref',
+            'note_citation', 'note_citation_ref', 'note_substitution_def',
+            'note_substitution_ref', 'note_pending', 'note_parse_message',
+            'has_name')
+
+# Stands for the chunk's document in recorded calls
+CHUNK_DOCUMENT = '<chunk>'
+
+# Settings that can be sent to the worker processes
+SETTING_TYPES = (str, int, float, bool, type(None), list, tuple, dict)
+
+
+class Parser(rst.Parser):
+
+    settings_spec = rst.Parser.settings_spec + (
+        'Parallel Parsing Options', None,
+        (('Parse top-level sections in this many processes. Default is 0, '
+          'parse in a single process.', ['--parse-processes'], {
+              'dest': 'parse_processes',
+              'type': 'int',
+              'metavar': '<n>',
+              'validator': frontend.validate_nonnegative_int,
+              'default': 0
+          }), ))
+
+    def parse(self, inputstring, document):
+        processes = getattr(document.settings, 'parse_processes', 0)
+        chunks = None
+        if processes > 1:
+            chunks = split_source(inputstring, document.settings, processes)
+        if chunks:
+            settings = {
+                k: v
+                for k, v in vars(document.settings).items()
+                if isinstance(v, SETTING_TYPES) and k != 'warning_stream'
+            }
+            with ProcessPoolExecutor(processes) as pool:
+                parsed = list(
+                    pool.map(parse_chunk, chunks, [settings] * len(chunks)))
+            if not can_merge(parsed):
+                chunks = None
+        if not chunks:
+            return super(Parser, self).parse(inputstring, document)
+
+        self.setup_parse(inputstring, document)
+        for (_, _, _, section_level), chunk in zip(chunks, parsed):
+            merge_chunk(document, section_parent(document, section_level),
+                        chunk)
+        self.finish_parse()
+
+
+class ChunkDocument(nodes.document):
+    """Document that records registrations instead of resolving them.
+
+    Nodes get placeholder ids ("#chunk:n", which no real id can look like)
+    and names are not checked for duplicates, that's done when replaying
+    the calls on the real document. For the same reason has_name is always
+    False here, the real answer is found when replaying it."""
+
+    def __init__(self, chunk, *args, **kwargs):
+        nodes.document.__init__(self, *args, **kwargs)
+        self.chunk = chunk
+        # What the reporter writes, to be passed on by merge_chunk
+        self.messages = io.StringIO()
+        self.calls = []
+        self.placeholders = 0
+        self.recording = 0
+
+    def set_id(self, node, msgnode=None, suggested_prefix=''):
+        if not node['ids']:
+            self.placeholders += 1
+            node['ids'].append('#%d:%d' % (self.chunk, self.placeholders))
+        return node['ids'][-1]
+
+    def note_names(self, node, msgnode=None, explicit=False):
+        pass
+
+    def note_substitution_def(self, subdef, def_name, msgnode=None):
+        pass
+
+
+def recorder(name):
+    method = getattr(ChunkDocument, name)
+
+    def record(self, *args, **kwargs):
+        if not self.recording:
+            location = (None, None)
+            if hasattr(self.reporter, 'get_source_and_line'):
+                location = self.reporter.get_source_and_line()
+            self.calls.append({
+                'name': name,
+                'args': tuple(CHUNK_DOCUMENT if arg is self else arg
+                              for arg in args),
+                'kwargs': kwargs,
+                # Messages added to these later go where they were
+                'lengths': tuple(
+                    len(arg) if isinstance(arg, nodes.Element) else None
+                    for arg in args),
+                # Nodes not yet in the tree get their line from location
+                'detached': tuple(
+                    isinstance(arg, nodes.Element) and arg.parent is None
+                    and arg is not self for arg in args),
+                'source': (self.current_source, self.current_line),
+                'location': location,
+                'messages': self.messages.tell(),
+            })
+        self.recording += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.recording -= 1
+
+    return record
+
+
+for _name in RECORDED:
+    setattr(ChunkDocument, _name, recorder(_name))
+
+
+class ChunkStateMachine(states.RSTStateMachine):
+    """RSTStateMachine that starts with known title styles and level."""
+
+    title_styles = ()
+
+    def runtime_init(self):
+        super(ChunkStateMachine, self).runtime_init()
+        self.memo.title_styles[:] = self.title_styles
+
+
+def split_source(inputstring, settings, processes):
+    """Split the source in chunks to parse separately.
+
+    Returns a list of (lines, offset, title_styles, section_level) or None
+    if the source can't or shouldn't be split."""
+    if (STATEFUL_DIRECTIVES.search(inputstring)
+            or not hasattr(states.RSTStateMachine, 'section_level_offset')):
+        return None
+    lines = statemachine.string2lines(inputstring,
+                                      tab_width=settings.tab_width,
+                                      convert_whitespace=True)
+    if any(len(line) > settings.line_length_limit for line in lines):
+        return None
+
+    titles = find_titles(lines)
+    title_styles = []
+    levels = []
+    for _, style in titles:
+        if style not in title_styles:
+            title_styles.append(style)
+        levels.append(title_styles.index(style) + 1)
+    split_level = None
+    for level in sorted(set(levels)):
+        if levels.count(level) > 1:
+            split_level = level
+            break
+    if split_level is None:
+        return None
+
+    starts = [
+        start for (start, _), level in zip(titles, levels)
+        if level == split_level
+    ]
+    # A few chunks per process, of about the same size
+    size = max(len(lines) // (processes * 4), 1)
+    bounds = [0]
+    for start in starts:
+        if start - bounds[-1] >= size or bounds == [0]:
+            bounds.append(start)
+    bounds.append(len(lines))
+    if len(bounds) < 4:
+        return None
+
+    chunks = [(lines[:bounds[1]], 0, (), 0)]
+    for begin, end in zip(bounds[1:], bounds[2:]):
+        chunks.append((lines[begin:end], begin, tuple(title_styles),
+                       split_level - 1))
+    return chunks
+
+
+def find_titles(lines):
+    """Return (first line, style) for every section title in lines.
+
+    Only unindented titles are considered, which is where section titles
+    can be."""
+    titles = []
+    i = 0
+    while i < len(lines) - 1:
+        line = lines[i]
+        above = lines[i - 1] if i else ''
+        below = lines[i + 1]
+        if ADORNMENT.match(line) and i + 2 < len(lines) and \
+                lines[i + 2].rstrip() == line.rstrip() and below.strip() and \
+                not ADORNMENT.match(below) and not above.strip():
+            # Overline, title, underline
+            titles.append((i, (line[0], line[0])))
+            i += 3
+            continue
+        if line.strip() and not line[0].isspace() and \
+                not above.strip() and not ADORNMENT.match(line) and \
+                ADORNMENT.match(below) and \
+                (len(below.rstrip()) >= len(line.rstrip()) or
+                 len(below.rstrip()) >= 4):
+            titles.append((i, below[0]))
+            i += 2
+            continue
+        i += 1
+    return titles
+
+
+def parse_chunk(chunk, settings):
+    """Parse one chunk, in a worker process.
+
+    Returns the chunk's nodes and the registrations made while parsing,
+    everything detached from the chunk's own document so it can be sent
+    back."""
+    lines, offset, title_styles, section_level = chunk
+    values = frontend.get_default_settings(rst.Parser)
+    values._update_loose(settings)
+    source_path = settings.get('_source') or '<string>'
+    document = ChunkDocument(offset, values, None, source=source_path)
+    values.warning_stream = document.messages
+    document.reporter = utils.new_reporter(source_path, values)
+    document.note_source(source_path, -1)
+    parser = rst.Parser()
+    parser.setup_parse('\n'.join(lines), document)
+    machine = ChunkStateMachine(state_classes=parser.state_classes,
+                                initial_state=parser.initial_state,
+                                debug=document.reporter.debug_flag)
+    machine.title_styles = list(title_styles)
+    machine.section_level_offset = section_level
+    source = document['source']
+    machine.run(statemachine.StringList(
+        lines, items=[(source, offset + i) for i in range(len(lines))]),
+                document,
+                input_offset=offset,
+                inliner=parser.inliner)
+    parser.finish_parse()
+
+    children = list(document.children)
+    for node in children:
+        node.parent = None
+    for node in children + [
+            arg for call in document.calls for arg in call['args']
+            if isinstance(arg, nodes.Node)
+    ]:
+        for subnode in node.findall(nodes.Node):
+            subnode.document = None
+    return {
+        'children': children,
+        'section_level': section_level,
+        'calls': document.calls,
+        'messages': document.messages.getvalue(),
+    }
+
+
+def can_merge(parsed):
+    """Check that the chunks fit together like a single doctree would."""
+    # Later chunks go into the last section of the levels above them
+    parent = parsed[0]['children']
+    for _ in range(parsed[1]['section_level']):
+        if not parent or not isinstance(parent[-1], nodes.section):
+            return False
+        parent = parent[-1].children
+    for chunk in parsed[1:]:
+        if not all(
+                isinstance(node, (nodes.section, nodes.system_message))
+                for node in chunk['children']):
+            return False
+    return True
+
+
+def section_parent(document, section_level):
+    """Return the node sections of section_level + 1 go into."""
+    parent = document
+    for _ in range(section_level):
+        parent = parent[-1]
+    return parent
+
+
+def merge_chunk(document, parent, chunk):
+    """Add a parsed chunk to document, as if it had been parsed there."""
+    base = len(parent)
+    parent.extend(chunk['children'])
+    for call in chunk['calls']:
+        for arg in call['args']:
+            if isinstance(arg, nodes.Node):
+                for node in arg.findall(nodes.Node):
+                    node.document = document
+
+    renamed = {}
+    waiting = {}
+    inserted = {}
+    taken = None
+    # The chunk's messages go out in the order they would have while
+    # parsing, between those the replayed calls make
+    written = 0
+    for call in chunk['calls']:
+        document.reporter.stream.write(
+            chunk['messages'][written:call['messages']])
+        written = max(written, call['messages'])
+        args = tuple(parent if arg is CHUNK_DOCUMENT else arg
+                     for arg in call['args'])
+        if call['name'] == 'has_name':
+            # The chunk was told the name was free, so the node registered
+            # next (a contents topic) claimed it. It must not if it's taken.
+            taken = args[0] if document.has_name(args[0]) else None
+            continue
+        node = args[0]
+        if taken is not None:
+            if isinstance(node, nodes.Element) and taken in node['names']:
+                node['names'].remove(taken)
+            taken = None
+        if isinstance(node, nodes.Element):
+            placeholders = [i for i in node['ids'] if i.startswith('#')]
+            if placeholders:
+                node['ids'] = [i for i in node['ids'] if not i.startswith('#')]
+                waiting[id(node)] = placeholders[0]
+        msgnodes = []
+        for arg, length in zip(args, call['lengths']):
+            if length is not None and all(arg is not m for m, _, _ in msgnodes):
+                offset = base if arg is parent else 0
+                msgnodes.append((arg, len(arg), offset + length))
+
+        # Put things back the way they were when the call was made, so
+        # messages get the same source and line
+        document.note_source(*call['source'])
+        location = call['location']
+        document.reporter.get_source_and_line = (
+            lambda lineno=None: (location[0], lineno or location[1]))
+        parents = [(arg, arg.parent)
+                   for arg, detached in zip(args, call['detached'])
+                   if detached]
+        for arg, _ in parents:
+            arg.parent = None
+        try:
+            getattr(document, call['name'])(*args, **call['kwargs'])
+        finally:
+            for arg, arg_parent in parents:
+                arg.parent = arg_parent
+            del document.reporter.get_source_and_line
+
+        if id(node) in waiting and node['ids']:
+            renamed[waiting.pop(id(node))] = node['ids'][0]
+        # Messages go where they would have been added while parsing
+        for msgnode, before, position in msgnodes:
+            added = msgnode[before:]
+            if added:
+                del msgnode[before:]
+                position += inserted.get(id(msgnode), 0)
+                msgnode[position:position] = added
+                inserted[id(msgnode)] = inserted.get(id(msgnode), 0) + len(added)
+
+    document.reporter.stream.write(chunk['messages'][written:])
+
+    if renamed:
+        for child in chunk['children']:
+            for node in child.findall(nodes.Element):
+                for key, value in node.attributes.items():
+                    if isinstance(value, str) and value in renamed:
+                        node[key] = renamed[value]
+                    elif isinstance(value, list):
+                        node[key] = [renamed.get(v, v) for v in value]
+        for old_id, new_id in renamed.items():
+            if old_id in document.refids:
+                document.refids.setdefault(new_id, []).extend(
+                    document.refids.pop(old_id))
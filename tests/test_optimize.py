@@ -0,0 +1,82 @@
+"""Deduplication of images and caching when optimizing PDFs."""
+
+import io
+
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+
+from sile import optimize  # noqa: E402
+from sile.optimize import optimize_pdf  # noqa: E402
+
+
+def make_pdf(*color_spaces):
+    """A page showing a 1x1 image for each color space.
+
+    Color spaces are functions that build one in the new PDF."""
+    pdf = pikepdf.Pdf.new()
+    pdf.add_blank_page()
+    images = pikepdf.Dictionary()
+    for i, color_space in enumerate(color_spaces):
+        images['/Im%d' % i] = pdf.make_stream(
+            b'\x07',
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=1,
+            Height=1,
+            BitsPerComponent=8,
+            ColorSpace=color_space(pdf))
+    pdf.pages[0].Resources = pikepdf.Dictionary(XObject=images)
+    output = io.BytesIO()
+    pdf.save(output)
+    return output.getvalue()
+
+
+def indexed(color):
+    def color_space(pdf):
+        # Differences after the 20 bytes pikepdf shows in a stream's repr
+        lookup = pdf.make_stream(b'\0' * 21 + color * 8)
+        return pikepdf.Array(
+            [pikepdf.Name.Indexed, pikepdf.Name.DeviceRGB, 7, lookup])
+    return color_space
+
+
+def icc_based(profile):
+    def color_space(pdf):
+        return pikepdf.Array(
+            [pikepdf.Name.ICCBased,
+             pdf.make_stream(b'\0' * 21 + profile, N=1)])
+    return color_space
+
+
+def image_objects(data):
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        xobjects = pdf.pages[0].Resources.XObject
+        return [xobjects[name].objgen for name in sorted(xobjects.keys())]
+
+
+@pytest.mark.parametrize('first, second', [
+    (indexed(b'\xff\0\0'), indexed(b'\0\0\xff')),
+    (icc_based(b'red profile'), icc_based(b'blue profile')),
+], ids=['palette', 'icc-profile'])
+def test_different_nested_streams_are_kept(first, second):
+    first_image, second_image = image_objects(
+        optimize_pdf(make_pdf(first, second)))
+    assert first_image != second_image
+
+
+def test_identical_images_are_merged():
+    red = indexed(b'\xff\0\0')
+    first_image, second_image = image_objects(optimize_pdf(make_pdf(red, red)))
+    assert first_image == second_image
+
+
+def test_cache_is_dropped_when_the_optimizer_changes(tmpdir, monkeypatch):
+    red = indexed(b'\xff\0\0')
+    data = make_pdf(red, red)
+    optimize_pdf(data, str(tmpdir))
+    for cached in tmpdir.listdir():
+        cached.write_binary(b'stale')
+    assert optimize_pdf(data, str(tmpdir)) == b'stale'
+    monkeypatch.setattr(optimize, '_optimizer_version', ['changed'])
+    assert optimize_pdf(data, str(tmpdir)) != b'stale'
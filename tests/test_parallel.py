@@ -0,0 +1,95 @@
+"""Parsing in several processes must give the same result as in one."""
+
+import io
+
+from docutils import frontend
+from docutils.core import publish_doctree, publish_string
+from docutils.parsers import rst
+import pytest
+
+from sile import parallel
+
+
+def cross_linked(count):
+    lines = [
+        'Big Doc', '=======', '', '.. contents::', '',
+        '.. |sub| replace:: substituted', ''
+    ]
+    for i in range(count):
+        lines += [
+            'Chapter %d' % i, '-' * 20, '',
+            'A |sub|, a footnote [#]_, a symbol [*]_, `Chapter %d`_, '
+            '`Details`_, [CIT%d]_, anon__, dup_ and bad_ref%d_.' %
+            ((i * 7) % count, i, i), '',
+            '__ http://example.com/%d' % i, '',
+            '.. [#] Auto footnote %d.' % i, '',
+            '.. [*] Symbol footnote %d.' % i, '',
+            '.. [CIT%d] Citation %d.' % (i, i), '',
+            'Details', '~~~~~~~', '',
+            '.. _dup:', '',
+            'See target%d_ and `inline dup`_ and _`inline dup`.' %
+            ((i + 3) % count), '',
+            '.. _target%d:' % i, '',
+            'Target paragraph.', ''
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def local_contents(count):
+    # Each .. contents:: only gets the "contents" name if it's still free
+    lines = ['Doc', '===', '', '.. contents::', '', 'See contents_.', '']
+    for i in range(count):
+        lines += [
+            'Chapter %d' % i, '-' * 20, '', '.. contents:: :local:', '',
+            'Text %d, see contents_.' % i, '', 'Sub %d' % i, '~' * 10, '',
+            'Body.', ''
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def broken_markup(count):
+    lines = ['Doc', '===', '']
+    for i in range(count):
+        lines += [
+            'Chapter %d' % i, '-' * 20, '',
+            'Broken *emphasis %d and dup_.' % i, '', '.. _dup:', '',
+            'Para.', '', 'Sub %d' % i, '~' * 10, '', 'Body `unclosed.', ''
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def parse(source, processes, **settings):
+    settings.setdefault('report_level', 5)
+    settings['parse_processes'] = processes
+    return publish_doctree(source,
+                           parser=parallel.Parser(),
+                           settings_overrides=settings)
+
+
+@pytest.mark.parametrize('source', [cross_linked(40), local_contents(40)],
+                         ids=['cross-linked', 'local-contents'])
+def test_same_as_single_process(source):
+    settings = frontend.get_default_settings(rst.Parser)
+    assert parallel.split_source(source, settings, 4), 'Not split'
+    assert parse(source, 4).pformat() == parse(source, 0).pformat()
+    sile_code = [
+        publish_string(source,
+                       parser=parallel.Parser(),
+                       writer='sile',
+                       settings_overrides={
+                           'parse_processes': processes,
+                           'report_level': 5
+                       }) for processes in (0, 4)
+    ]
+    assert sile_code[0] == sile_code[1]
+
+
+def test_messages_go_to_the_warning_stream():
+    source = broken_markup(30)
+    messages = []
+    for processes in (0, 4):
+        stream = io.StringIO()
+        parse(source, processes, report_level=1, warning_stream=stream)
+        messages.append(stream.getvalue())
+    assert 'Inline emphasis start-string without end-string' in messages[0]
+    assert messages[0] == messages[1]